@@ -5,14 +5,179 @@ Parses markdown files with annotations to create code transformation animations
 """
 
 import re
-import os
 import sys
-from typing import List, Dict, Optional
+import functools
+from collections import defaultdict
+from typing import List, Dict, NamedTuple, Optional
 from pathlib import Path
 from manimlib import *
 from pygments import lex
 from pygments.lexers import get_lexer_by_name
+from pygments.formatters.pangomarkup import escape_special_chars
+from pygments.styles import get_style_by_name
 from pygments.token import Token
+from pygments.util import ClassNotFound
+
+
+_TITLE_RE = re.compile(r"^#\s+(.*)", re.MULTILINE)
+_BLOCK_RE = re.compile(r'```(\w*)\s*(.*?)\n(.*?)```', re.DOTALL)
+# All block annotations in one alternation; the matching group name says which one was hit
+_ANN_RE = re.compile(
+    r'@(?:step(?P<step>\d+)'
+    r'|highlight\[(?P<hl>[^\]]*)\]'
+    r'|(?P<transform>transform)(?:\[(?P<tf>[^\]]*)\])?'
+    r'|isolate\[(?P<iso>[^\]]*)\]'
+    r'|wait\[(?P<wait>[\d.]+)\]'
+    r'|fontsize\[(?P<fs>\d+)\]'
+    r'|(?P<write>write))'
+)
+# "old->new" pairs inside @transform[...]; malformed entries are skipped
+_TRANSFORM_PAIR_RE = re.compile(r'([^,]+)->([^,]+)')
+
+
+@functools.lru_cache(maxsize=32)
+def _get_lexer(name: str):
+    """Return the Pygments lexer for a language name, or None if there is none"""
+    try:
+        return get_lexer_by_name(name)
+    except ClassNotFound:
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def _get_style(name: str):
+    """Return the Pygments style class for a style name"""
+    return get_style_by_name(name)
+
+
+def _token_markup(style, ttype) -> tuple:
+    """Opening and closing Pango tags for a token type, as PangoMarkupFormatter writes them"""
+    while not style.styles_token(ttype):
+        ttype = ttype.parent
+    token_style = style.style_for_token(ttype)
+    start = ''
+    end = ''
+    if token_style['color']:
+        start += f'<span fgcolor="#{token_style["color"]}">'
+        end = '</span>' + end
+    if token_style['bold']:
+        start += '<b>'
+        end = '</b>' + end
+    if token_style['italic']:
+        start += '<i>'
+        end = '</i>' + end
+    if token_style['underline']:
+        start += '<u>'
+        end = '</u>' + end
+    return start, end
+
+
+@functools.lru_cache(maxsize=8)
+def _markup_table(code_style: str) -> Dict:
+    """Pango tags for every token type Pygments currently knows, resolved once per style"""
+    style = _get_style(code_style)
+    table = {}
+    pending = [Token]
+    while pending:
+        ttype = pending.pop()
+        table[ttype] = _token_markup(style, ttype)
+        pending.extend(ttype.subtypes)
+    return table
+
+
+@functools.lru_cache(maxsize=256)
+def _markup_for_ttype(code_style: str, ttype) -> tuple:
+    """Pango tags for a token type missing from _markup_table, memoized per style"""
+    return _token_markup(_get_style(code_style), ttype)
+
+
+def _highlight_markup(code: str, lexer, code_style: str = "monokai") -> str:
+    """
+    Lex code into Pango markup for MarkupText
+    
+    Neighbouring tokens that render the same are merged into one run, and
+    whitespace joins whatever run it follows, so Pango gets one span per
+    color change instead of one per token.
+    """
+    table = _markup_table(code_style)
+    runs = []
+    run_markup = None
+    buffer = []
+    for ttype, tvalue in lex(code, lexer):
+        # Whitespace only shows its color through an underline
+        if tvalue.isspace() and run_markup is not None and '<u>' not in run_markup[0]:
+            buffer.append(tvalue)
+            continue
+        markup = table.get(ttype)
+        if markup is None:
+            # Token type created after the table was built, e.g. by a lexer imported since
+            markup = _markup_for_ttype(code_style, ttype)
+        if markup != run_markup:
+            if buffer:
+                runs.append((run_markup, ''.join(buffer)))
+            run_markup = markup
+            buffer = []
+        buffer.append(tvalue)
+    if buffer:
+        runs.append((run_markup, ''.join(buffer)))
+    
+    return ''.join(start + escape_special_chars(text) + end for (start, end), text in runs)
+
+
+class CodeBlock(NamedTuple):
+    """One fenced block from the markdown file and its annotations"""
+    language: Optional[str]
+    code: str
+    step: int
+    wait: float
+    use_transform: bool
+    use_write: bool
+    fontsize: int
+    highlights: List[str]
+    transforms: Dict[str, str]
+    isolate: List[str]
+
+
+def _build_text_mob(block: CodeBlock) -> Mobject:
+    """Text-only slide for a block without a language"""
+    # Text and MarkupText are created centered on ORIGIN, no move_to needed
+    return Text(
+        block.code,
+        font_size=block.fontsize,
+        color=WHITE,
+        line_width = 2
+    )
+
+
+def _build_code_mob(block: CodeBlock) -> Mobject:
+    """Syntax-highlighted slide, or plain text if Pygments has no lexer for the language"""
+    font_size = block.fontsize
+    lexer = _get_lexer(block.language)
+    
+    if lexer is None:
+        print(f"No lexer found for language: {block.language}")
+        return Text(
+            block.code,
+            font_size=font_size,
+            color=WHITE
+        )
+    
+    # Same markup Code would build, but with same-colored tokens merged into single spans.
+    # No fill/stroke color, as in Code: StringMobject would otherwise paint every
+    # glyph white over the span colors
+    return MarkupText(
+        _highlight_markup(block.code, lexer, code_style="monokai"),
+        font="Consolas",
+        font_size=font_size,
+        lsh=1.0,
+        fill_color=None,
+        stroke_color=None,
+        line_width = 3
+    )
+
+
+# Mobject builder per block language; None means a text-only slide
+_BUILDERS = defaultdict(lambda: _build_code_mob, {None: _build_text_mob})
 
 
 class MarkdownCodeParser:
@@ -32,42 +197,49 @@ class MarkdownCodeParser:
         Plain text explanation here
         ```
         """
-        title_match = re.search(r"^#\s+(.*)", content, re.MULTILINE)
+        title_match = _TITLE_RE.search(content)
         title = title_match.group(1).strip() if title_match else None
         
         code_blocks = []
-        # Updated pattern to make language optional
-        pattern = r'```(\w*)\s*(.*?)\n(.*?)```'
-        matches = re.finditer(pattern, content, re.DOTALL)
+        # Blocks are usually written in step order, only sort when they aren't
+        needs_sort = False
+        # Language is optional, see _BLOCK_RE
+        matches = _BLOCK_RE.finditer(content)
         
         for match in matches:
             language = match.group(1) if match.group(1) else None
             annotations = match.group(2)
             code = match.group(3).lstrip('\n').rstrip('\n')
             
-            step_match = re.search(r'@step(\d+)', annotations)
-            highlight_match = re.search(r'@highlight\[(.*?)\]', annotations)
-            transform_match = re.search(r'@transform\[(.*?)\]', annotations)
-            isolate_match = re.search(r'@isolate\[(.*?)\]', annotations)
-            wait_match = re.search(r'@wait\[([\d.]+)\]', annotations)
-            transform_flag = re.search(r'@transform', annotations)
-            write_flag = re.search(r'@write', annotations)
-            fontsize_match = re.search(r'@fontsize\[(\d+)\]', annotations)
+            # Single scan over the annotations, first occurrence of each one wins
+            found = {}
+            for ann in _ANN_RE.finditer(annotations):
+                kind = ann.lastgroup
+                if kind in ('transform', 'tf'):
+                    found.setdefault('transform', True)
+                    if ann.group('tf') is not None:
+                        found.setdefault('tf', ann.group('tf'))
+                else:
+                    found.setdefault(kind, ann.group(kind))
             
-            code_blocks.append({
-                'language': language,  # Can be None for plain text
-                'code': code,
-                'step': int(step_match.group(1)) if step_match else 0,
-                'wait': float(wait_match.group(1)) if wait_match else 1.5,
-                'use_transform': bool(transform_flag),
-                'use_write': bool(write_flag),
-                'fontsize': int(fontsize_match.group(1)) if fontsize_match else 24,
-                'highlights': highlight_match.group(1).split(',') if highlight_match else [],
-                'transforms': dict(t.split('->') for t in transform_match.group(1).split(',')) if transform_match else {},
-                'isolate': isolate_match.group(1).split(',') if isolate_match else []
-            })
+            code_blocks.append(CodeBlock(
+                language=language,  # Can be None for plain text
+                code=code,
+                step=int(found['step']) if 'step' in found else 0,
+                wait=float(found['wait']) if 'wait' in found else 1.5,
+                use_transform='transform' in found,
+                use_write='write' in found,
+                fontsize=int(found['fs']) if 'fs' in found else 24,
+                highlights=found['hl'].split(',') if 'hl' in found else [],
+                transforms=dict(_TRANSFORM_PAIR_RE.findall(found['tf'])) if 'tf' in found else {},
+                isolate=found['iso'].split(',') if 'iso' in found else []
+            ))
+            if len(code_blocks) > 1 and code_blocks[-1].step < code_blocks[-2].step:
+                needs_sort = True
         
-        return {"title": title, "code_blocks": sorted(code_blocks, key=lambda x: x['step'])}
+        if needs_sort:
+            code_blocks.sort(key=lambda x: x.step)
+        return {"title": title, "code_blocks": code_blocks}
 
 
 class MarkdownCodeScene(Scene):
@@ -83,8 +255,27 @@ class MarkdownCodeScene(Scene):
         """
         
         self.markdown_path = markdown_path
+        # Built mobjects keyed by (code, language, fontsize), see cached_mobject
+        self._mob_cache: Dict[tuple, Mobject] = {}
         super().__init__(**kwargs)
     
+    def cached_mobject(self, key: tuple, build) -> Mobject:
+        """
+        Return the mobject for a block, building it only the first time its key is seen
+        
+        Args:
+            key: (code, language, fontsize) of the block
+            build: Zero-argument callable creating the mobject
+            
+        Returns:
+            The built mobject, or a copy of it when the same block recurs
+        """
+        if key in self._mob_cache:
+            return self._mob_cache[key].copy()
+        mob = build()
+        self._mob_cache[key] = mob
+        return mob
+    
     def load_markdown_file(self, file_path: str) -> Optional[str]:
         """
         Load markdown content from various possible locations
@@ -95,18 +286,19 @@ class MarkdownCodeScene(Scene):
         Returns:
             Markdown content as string, or None if not found
         """
-        # Try multiple locations
-        search_paths = [
-            file_path,  # Exact path provided
-            os.path.abspath(file_path),  # Absolute path
-            os.path.join(os.getcwd(), file_path),  # Current working directory
-            os.path.join(os.path.dirname(__file__), file_path),  # Same directory as script
-            os.path.expanduser(file_path),  # Expand ~ for home directory
-        ]
+        path = Path(file_path).expanduser()  # Expand ~ for home directory
+        if path.is_absolute():
+            # Exact path provided, nothing else to try
+            search_paths = (path,)
+        else:
+            search_paths = (
+                Path.cwd() / path,  # Current working directory
+                Path(__file__).parent / path,  # Same directory as script
+            )
         
         for path in search_paths:
             try:
-                if os.path.isfile(path):
+                if path.is_file():
                     with open(path, 'r', encoding='utf-8') as f:
                         return f.read()
             except (OSError, IOError):
@@ -114,6 +306,18 @@ class MarkdownCodeScene(Scene):
         
         return None
     
+    def build_mobject(self, block: CodeBlock) -> Mobject:
+        """
+        Create the mobject for one parsed code block
+        
+        Args:
+            block: Code block as returned by MarkdownCodeParser.parse_markdown
+            
+        Returns:
+            Syntax-highlighted MarkupText for code, Text for plain text slides
+        """
+        return _BUILDERS[block.language](block)
+    
     def construct(self):
         # Determine which markdown file to use
         # Check for command-line argument
@@ -151,71 +355,34 @@ class MarkdownCodeScene(Scene):
             self.wait(2)
             return
         
-        # Manually create syntax-highlighted code from basic Text objects
-        font_size = 12
-        
+        # Build one mobject per slide
         code_mobs = []
         for block in code_blocks:
-            # Get fontsize for this specific block, defaulting to 12
-            font_size = block.get('fontsize', 12)
-
-            # Conditional rendering based on whether a language is specified
-            if not block['language']:
-                # It's a text-only slide
-                text_mobject = Text(
-                    block['code'],
-                    font_size=font_size,
-                    color=WHITE,
-                    line_width = 2
-                )
-                text_mobject.move_to(ORIGIN)
-                code_mobs.append(text_mobject)
-                continue
-            
-            # Use Code class which handles lexing, tokenizing, and syntax highlighting internally
-            try:
-                code_obj = Code(
-                    block['code'],
-                    language=block['language'],
-                    font="Consolas",
-                    font_size=font_size,
-                    code_style="monokai",
-                    line_width = 3
-                )
-                code_obj.move_to(ORIGIN)
-                code_mobs.append(code_obj)
-            except Exception as e:
-                print(f"Error creating Code object: {e}")
-                # Fallback to plain text if Code fails
-                text_mobject = Text(
-                    block['code'],
-                    font_size=font_size,
-                    color=WHITE
-                )
-                text_mobject.move_to(ORIGIN)
-                code_mobs.append(text_mobject)
+            # Identical blocks (e.g. repeated between steps) are only built once
+            key = (block.code, block.language, block.fontsize)
+            code_mobs.append(self.cached_mobject(key, lambda: self.build_mobject(block)))
         
         # Animate the code blocks
         if code_mobs:
             # Animate the first slide's appearance
             current_code = code_mobs[0]
-            if code_blocks[0].get('use_write', False):
+            if code_blocks[0].use_write:
                 self.play(Write(current_code), run_time=2)
             else:
                 self.play(FadeIn(current_code)) # Default to FadeIn
-            self.wait(code_blocks[0].get('wait', 1.5))
+            self.wait(code_blocks[0].wait)
 
             # Animate transitions for subsequent slides
             for i in range(1, len(code_mobs)):
                 next_code = code_mobs[i]
                 
                 # Check for @write first (highest priority)
-                if code_blocks[i].get('use_write', False):
+                if code_blocks[i].use_write:
                     self.play(FadeOut(current_code))
                     self.play(Write(next_code), run_time=2)
                 
                 # Then check for @transform
-                elif code_blocks[i].get('use_transform', False):
+                elif code_blocks[i].use_transform:
                     self.play(ReplacementTransform(current_code, next_code), run_time=1.5)
                 
                 # Default to cross-fade
@@ -223,7 +390,7 @@ class MarkdownCodeScene(Scene):
                     self.play(FadeOut(current_code), FadeIn(next_code), run_time=0.75)
                 
                 # Wait for the duration specified for the new slide
-                self.wait(code_blocks[i].get('wait', 1.5))
+                self.wait(code_blocks[i].wait)
 
                 current_code = next_code
             
@@ -274,8 +441,13 @@ var result = numbers
             self.wait(1)
         
         # Create and animate code mobjects
-        code_mobs = [Text(block['code'], font="Monospace", font_size=24, color=WHITE) 
-                     for block in code_blocks]
+        code_mobs = [
+            self.cached_mobject(
+                (block.code, block.language, 24),
+                lambda block=block: Text(block.code, font="Monospace", font_size=24, color=WHITE)
+            )
+            for block in code_blocks
+        ]
         
         for mob in code_mobs:
             if title: